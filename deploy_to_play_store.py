@@ -1,7 +1,16 @@
 
+import functools
+import hashlib
+import logging
+import mmap
 import os
+import random
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from google.oauth2 import service_account
 
@@ -10,49 +19,188 @@ PACKAGE_NAME = 'com.ifautofab'
 BUNDLE_PATH = 'app/build/outputs/bundle/release/app-release.aab'
 KEY_FILE = 'play-store-key.json'
 TRACK = 'internal'
+UPLOAD_CHUNK_SIZE = 20 * 1024 * 1024
+# googleapiclient's own retries cover 429/5xx responses and transport errors
+# (timeouts, resets, SSL failures) with randomized exponential backoff
+API_RETRIES = 5
+COMMIT_TRIES = 4
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
 
-def deploy():
-    if not os.path.exists(KEY_FILE):
-        print(f"Error: {KEY_FILE} not found in project root.")
-        return
+log = logging.getLogger(__name__)
 
-    if not os.path.exists(BUNDLE_PATH):
-        print(f"Error: {BUNDLE_PATH} not found. Did you run './gradlew :app:bundleRelease'?")
-        return
+@contextmanager
+def _step(name):
+    """Log how long the wrapped deploy step took."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        log.info("%s took %.2fs", name, time.monotonic() - start)
 
-    print(f"Starting deployment for {PACKAGE_NAME}...")
+def _is_transient(error):
+    # Socket timeouts, connection resets and SSL errors are all OSErrors
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES
+    return isinstance(error, OSError)
 
-    # Authenticate
-    credentials = service_account.Credentials.from_service_account_file(KEY_FILE)
-    service = build('androidpublisher', 'v3', credentials=credentials)
+def _version_on_tracks(service, version_code, tracks):
+    """Check in a fresh, throwaway edit whether every track already serves version_code."""
+    edit = service.edits().insert(packageName=PACKAGE_NAME, body={}).execute(num_retries=API_RETRIES)
+    edit_id = edit['id']
+    try:
+        listing = service.edits().tracks().list(
+            packageName=PACKAGE_NAME, editId=edit_id
+        ).execute(num_retries=API_RETRIES)
+    finally:
+        service.edits().delete(packageName=PACKAGE_NAME, editId=edit_id).execute(num_retries=API_RETRIES)
+    live = {
+        track['track']
+        for track in listing.get('tracks', [])
+        for release in track.get('releases', [])
+        if str(version_code) in release.get('versionCodes', [])
+    }
+    return all(track in live for track in tracks)
 
-    # Create a new edit
-    edit_request = service.edits().insert(packageName=PACKAGE_NAME, body={})
-    edit_results = edit_request.execute()
-    edit_id = edit_results['id']
+def _commit(service, edit_id, version_code, tracks, tries=COMMIT_TRIES):
+    """Commit the edit without blindly retrying it.
 
-    print(f"Created edit with ID: {edit_id}")
+    edits.commit is not idempotent: an attempt can succeed on Google's side and
+    still come back as a 5xx or time out, after which a retry fails because the
+    edit no longer exists. So after any failure past the first attempt, and
+    before every retry, check whether the release actually went out.
+    """
+    for attempt in range(tries):
+        try:
+            return service.edits().commit(packageName=PACKAGE_NAME, editId=edit_id).execute()
+        except Exception as e:
+            if attempt == 0 and not _is_transient(e):
+                raise
+            if _version_on_tracks(service, version_code, tracks):
+                log.warning("Commit reported %s, but the release is live; continuing", e)
+                return None
+            if not _is_transient(e) or attempt == tries - 1:
+                raise
+            delay = min(32, 2 ** attempt) + random.random()
+            log.warning("Commit failed (%s), retrying in %.1fs...", e, delay)
+            time.sleep(delay)
 
-    # Upload the bundle
-    print(f"Uploading {BUNDLE_PATH}...")
-    bundle_file = MediaFileUpload(BUNDLE_PATH, mimetype='application/octet-stream', resumable=True)
+@functools.lru_cache(maxsize=1)
+def _credentials():
+    return service_account.Credentials.from_service_account_file(KEY_FILE)
+
+@functools.lru_cache(maxsize=1)
+def _service():
+    return build('androidpublisher', 'v3', credentials=_credentials())
+
+def _release_status(service, edit_id):
+    """Return the release status the app will accept for a new release.
+
+    Apps that have never been published are in the 'Draft' state and only
+    accept draft releases. Once any release has gone out, at least one track
+    holds a non-draft release.
+    """
+    tracks = service.edits().tracks().list(
+        packageName=PACKAGE_NAME, editId=edit_id
+    ).execute(num_retries=API_RETRIES)
+    for track in tracks.get('tracks', []):
+        for release in track.get('releases', []):
+            if release.get('status') != 'draft':
+                return 'completed'
+    return 'draft'
+
+def _bundle_sha256():
+    # hashlib reads the mapping directly, so the whole bundle is hashed in one
+    # C-level pass without being copied into Python bytes
+    with open(BUNDLE_PATH, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.sha256(mm).hexdigest()
+
+def _upload_bundle(service, edit_id):
+    bundle_file = MediaFileUpload(
+        BUNDLE_PATH,
+        mimetype='application/octet-stream',
+        chunksize=UPLOAD_CHUNK_SIZE,
+        resumable=True
+    )
     upload_request = service.edits().bundles().upload(
         packageName=PACKAGE_NAME,
         editId=edit_id,
         media_body=bundle_file
     )
-    
-    bundle_response = upload_request.execute()
+
+    bundle_response = None
+    while bundle_response is None:
+        progress, bundle_response = upload_request.next_chunk(num_retries=API_RETRIES)
+        if progress:
+            log.info("Uploaded %d%%", int(progress.progress() * 100))
+    return bundle_response
+
+def deploy(tracks=(TRACK,)):
+    # Accept a single track name, and don't update the same track twice
+    if isinstance(tracks, str):
+        tracks = (tracks,)
+    tracks = tuple(dict.fromkeys(tracks))
+
+    if not os.path.exists(KEY_FILE):
+        log.error("Error: %s not found in project root.", KEY_FILE)
+        return
+
+    if not os.path.exists(BUNDLE_PATH):
+        log.error("Error: %s not found. Did you run './gradlew :app:bundleRelease'?", BUNDLE_PATH)
+        return
+
+    if os.path.getsize(BUNDLE_PATH) == 0:
+        log.error("Error: %s is empty. Did './gradlew :app:bundleRelease' fail?", BUNDLE_PATH)
+        return
+
+    log.info("Starting deployment for %s...", PACKAGE_NAME)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # Hash the bundle while the client is built and the edit is created
+        digest_future = executor.submit(_bundle_sha256)
+
+        # Authenticate
+        with _step("Client setup"):
+            service = _service()
+
+        # Create a new edit
+        edit_request = service.edits().insert(packageName=PACKAGE_NAME, body={})
+        with _step("Edit creation"):
+            edit_results = edit_request.execute(num_retries=API_RETRIES)
+        edit_id = edit_results['id']
+
+        log.info("Created edit with ID: %s", edit_id)
+        bundle_sha256 = digest_future.result()
+
+    # Upload the bundle
+    log.info("Uploading %s...", BUNDLE_PATH)
+    with _step("Upload"):
+        bundle_response = _upload_bundle(service, edit_id)
     version_code = bundle_response['versionCode']
-    print(f"Successfully uploaded bundle version {version_code}")
+    # Play reports the SHA-256 of what it received; compare it against the
+    # local digest instead of trusting the transfer blindly
+    if bundle_response.get('sha256') not in (None, bundle_sha256):
+        raise RuntimeError(
+            f"Uploaded bundle hash {bundle_response['sha256']} does not match "
+            f"local hash {bundle_sha256}"
+        )
+    log.info("Successfully uploaded bundle version %s (sha256 %s)", version_code, bundle_sha256)
+
+    # Assign bundle to tracks. The track updates and commit are deliberately not
+    # sent through a BatchHttpRequest: sub-requests in a batch have no guaranteed
+    # order, and the commit must only run once the track updates have been applied.
+    # All tracks share this one edit rather than fanning out an edit per track:
+    # committing an edit invalidates every other open edit for the app.
+    with _step("Release status check"):
+        status = _release_status(service, edit_id)
+    if status == 'draft':
+        log.info("App is still in 'Draft' state. Creating a draft release...")
 
-    # Assign bundle to track
-    def update_track(status):
-        print(f"Assigning version {version_code} to {TRACK} track as {status}...")
+    for track in tracks:
+        log.info("Assigning version %s to %s track as %s...", version_code, track, status)
         track_request = service.edits().tracks().update(
             packageName=PACKAGE_NAME,
             editId=edit_id,
-            track=TRACK,
+            track=track,
             body={
                 'releases': [{
                     'versionCodes': [str(version_code)],
@@ -60,25 +208,20 @@ def deploy():
                 }]
             }
         )
-        track_request.execute()
+        with _step(f"Track update ({track})"):
+            track_request.execute(num_retries=API_RETRIES)
 
-    try:
-        update_track('completed')
-        print("Committing changes to Google Play...")
-        service.edits().commit(packageName=PACKAGE_NAME, editId=edit_id).execute()
-    except Exception as e:
-        if "Only releases with status draft may be created on draft app" in str(e):
-            print("App is still in 'Draft' state. Falling back to draft release...")
-            update_track('draft')
-            service.edits().commit(packageName=PACKAGE_NAME, editId=edit_id).execute()
-        else:
-            raise e
+    log.info("Committing changes to Google Play...")
+    with _step("Commit"):
+        _commit(service, edit_id, version_code, tracks)
 
-    print("Deployment successful! Check the Google Play Console to review and roll out.")
+    log.info("Deployment successful! Check the Google Play Console to review and roll out.")
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
     try:
-        deploy()
+        # Optional track names on the command line, e.g. `internal alpha`
+        deploy(sys.argv[1:] or (TRACK,))
     except Exception as e:
-        print(f"Error during deployment: {e}")
+        log.error("Error during deployment: %s", e)
         sys.exit(1)
@@ -1,86 +1,178 @@
 
 import os
+import re
 import sys
 import json
-import urllib.request
-import urllib.error
+import functools
+import gzip
+import hashlib
+import shelve
+import ssl
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
+try:
+    import httpx
+    import h2  # noqa: F401 -- required by httpx for http2=True
+except ImportError:
+    httpx = None
+
+API_HOST = "api.groq.com"
+API_PATH = "/openai/v1/chat/completions"
+MODEL = "llama-3.1-8b-instant"
+
+# Mimic the simplified prompt structure from the app
+SYSTEM_PROMPT = """
+You are a command rewriter for a Z-machine text adventure game.
+Your job is to translate the player's natural language intent into a valid 1-2 word parser command.
+
+Vocabulary:
+- Verbs: take, drop, look, inventory, go, north, south, east, west, up, down
+- Nouns sword, lantern, key
+
+Rules:
+1. Output ONLY the rewritten command.
+2. Do not explain.
+3. If you cannot rewrite it, output <NO_VALID_REWRITE>.
+"""
+
+# The parts of the request that are the same for every command, built once
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+_BASE_REQUEST = {
+    "model": MODEL,
+    "temperature": 0.3,
+    "max_tokens": 50
+}
+
+# With --cache, rewrites are kept on disk between runs. Entries are scoped to
+# the model and system prompt so that editing either one doesn't serve stale
+# rewrites.
+CACHE_FILE = '.llm_cache'
+_CACHE_SCOPE = hashlib.sha1(f"{MODEL}\0{SYSTEM_PROMPT}".encode('utf-8')).hexdigest()[:12]
+
+# Request bodies at least this large are gzipped before sending. Today's prompt
+# is well under it; compression starts paying off once the system prompt grows
+# to carry a full game vocabulary or few-shot examples.
+GZIP_MIN_BODY_SIZE = 4096
+
+# Groq rate-limits aggressively; keep the number of in-flight requests small
+MAX_CONCURRENT_REQUESTS = 8
+
+# Built once and shared; loading the CA bundle for every request is wasted work
+_SSL_CONTEXT = ssl.create_default_context()
+_local = threading.local()
+
+# With httpx[http2] installed, every worker shares one HTTP/2 connection and its
+# requests run as concurrent streams on it; otherwise fall back to one
+# HTTP/1.1 keep-alive connection per worker
+_HTTP2_CLIENT = (
+    httpx.Client(base_url=f"https://{API_HOST}", http2=True, timeout=30, verify=_SSL_CONTEXT)
+    if httpx else None
+)
+
+def _get_connection():
+    # http.client connections are not thread-safe, so each worker keeps its own
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = http.client.HTTPSConnection(API_HOST, timeout=30, context=_SSL_CONTEXT)
+        _local.conn = conn
+    return conn
+
+def _reset_connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def _post(body, headers):
+    """POST to the Groq endpoint, returning (status, reason, body)."""
+    if _HTTP2_CLIENT is not None:
+        response = _HTTP2_CLIENT.post(API_PATH, content=body, headers=headers)
+        return response.status_code, response.reason_phrase, response.content
+
+    conn = _get_connection()
+    reused = conn.sock is not None
+    try:
+        conn.request("POST", API_PATH, body=body, headers=headers)
+        response = conn.getresponse()
+    except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+        _reset_connection()
+        if not reused:
+            raise
+        # The server closed the idle keep-alive connection; retry once on a new one
+        conn = _get_connection()
+        conn.request("POST", API_PATH, body=body, headers=headers)
+        response = conn.getresponse()
+    data = response.read()
+    if response.getheader('Content-Encoding') == 'gzip':
+        data = gzip.decompress(data)
+    return response.status, response.reason, data
+
+_API_KEY_PATTERN = re.compile(r'^[ \t]*groq\.api\.key=(.*?)[ \t\r]*$', re.MULTILINE)
+
+@functools.lru_cache(maxsize=1)
 def load_api_key():
     try:
         with open('local.properties', 'r') as f:
-            for line in f:
-                if line.strip().startswith('groq.api.key='):
-                    return line.strip().split('=', 1)[1]
+            data = f.read()
     except FileNotFoundError:
         print("Error: local.properties not found.")
         return None
-    return None
+    match = _API_KEY_PATTERN.search(data)
+    return match.group(1) if match else None
 
 def build_prompt(command):
-    # Mimic the simplified prompt structure from the app
-    system_prompt = """
-    You are a command rewriter for a Z-machine text adventure game.
-    Your job is to translate the player's natural language intent into a valid 1-2 word parser command.
-    
-    Vocabulary:
-    - Verbs: take, drop, look, inventory, go, north, south, east, west, up, down
-    - Nouns sword, lantern, key
-    
-    Rules:
-    1. Output ONLY the rewritten command.
-    2. Do not explain.
-    3. If you cannot rewrite it, output <NO_VALID_REWRITE>.
-    """
-    
+    """Return the encoded JSON request body for a single command."""
     user_prompt = f"Command: {command}\nError: Command not understood"
     
-    return {
-        "model": "llama-3.1-8b-instant",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 0.3,
-        "max_tokens": 50
-    }
+    data = dict(_BASE_REQUEST)
+    data["messages"] = [_SYSTEM_MESSAGE, {"role": "user", "content": user_prompt}]
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
 
 def call_groq(api_key, command):
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    data = build_prompt(command)
-    json_data = json.dumps(data).encode('utf-8')
+    json_data = build_prompt(command)
     
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}",
-        "User-Agent": "IFAutoFab-Test/1.0"
+        "User-Agent": "IFAutoFab-Test/1.0",
+        "Accept-Encoding": "gzip"
     }
-    
-    import ssl
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
+    if len(json_data) >= GZIP_MIN_BODY_SIZE:
+        # Level 1 gets most of the size reduction on JSON for a fraction of the CPU
+        json_data = gzip.compress(json_data, compresslevel=1)
+        headers["Content-Encoding"] = "gzip"
 
     try:
-        req = urllib.request.Request(url, data=json_data, headers=headers, method='POST')
-        with urllib.request.urlopen(req, context=ctx) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result['choices'][0]['message']['content']
-    except urllib.error.HTTPError as e:
-        print(f"HTTP Error: {e.code} - {e.reason}")
-        print(e.read().decode('utf-8'))
-        return None
+        status, reason, body = _post(json_data, headers)
+        if status >= 400:
+            print(f"HTTP Error: {status} - {reason}")
+            print(body.decode('utf-8'))
+            return None
+        result = json.loads(body)
+        return result['choices'][0]['message']['content']
     except Exception as e:
         print(f"Error: {e}")
+        _reset_connection()
         return None
 
+def _cache_key(command):
+    normalized = ' '.join(command.lower().split())
+    return f"{_CACHE_SCOPE}:{normalized}"
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 test_llm.py \"your command here\"")
-        print("Example: python3 test_llm.py \"grab the sword\"")
+    args = sys.argv[1:]
+    # Off by default: a cache hit proves nothing about the key, endpoint or TLS
+    use_cache = '--cache' in args
+    commands = [arg for arg in args if arg != '--cache']
+    if not commands:
+        print("Usage: python3 test_llm.py [--cache] \"your command here\" [\"another command\" ...]")
+        print("Example: python3 test_llm.py \"grab the sword\" \"light the lamp\"")
         sys.exit(1)
 
-    command = sys.argv[1]
-    print(f"Checking configuration and testing LLM rewrite for: '{command}'")
+    print(f"Checking configuration and testing LLM rewrite for {len(commands)} command(s)")
     
     api_key = load_api_key()
     if not api_key:
@@ -89,16 +181,41 @@ def main():
         sys.exit(1)
         
     print(f"✅ Found API Key: {api_key[:4]}...{api_key[-4:]}")
+
+    # Commands that normalize to the same key only need one request
+    keys = {command: _cache_key(command) for command in commands}
+    unique = {}
+    for command in commands:
+        unique.setdefault(keys[command], command)
+
+    with shelve.open(CACHE_FILE) if use_cache else nullcontext({}) as cache:
+        rewrites = {key: cache[key] for key in unique if key in cache}
+        misses = [key for key in unique if key not in rewrites]
+        if rewrites:
+            print(f"Using {len(rewrites)} cached rewrite(s)")
+
+        if misses:
+            print(f"Sending {len(misses)} request(s) to Groq ({MODEL})...")
+            workers = min(MAX_CONCURRENT_REQUESTS, len(misses))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(lambda key: call_groq(api_key, unique[key]), misses)
+                for key, result in zip(misses, results):
+                    rewrites[key] = result
+                    if result:
+                        cache[key] = result
     
-    print("Sending request to Groq (llama-3.1-8b-instant)...")
-    result = call_groq(api_key, command)
-    
-    if result:
+    for command in commands:
+        result = rewrites[keys[command]]
         print(f"\nOriginal: '{command}'")
-        print(f"Rewritten: '{result}'")
+        print(f"Rewritten: '{result}'" if result else "Rewritten: <failed>")
+
+    if not all(rewrites.values()):
+        print("\n❌ Test Failed.")
+    elif misses:
         print("\n✅ Test Passed! The API integration is working.")
     else:
-        print("\n❌ Test Failed.")
+        print("\n⚠️  All rewrites came from the cache; the API was not contacted.")
+        print("Run without --cache to check the API integration.")
 
 if __name__ == "__main__":
     main()